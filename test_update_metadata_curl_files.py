@@ -4,6 +4,7 @@ import os
 import os.path
 import shutil
 import stat
+import subprocess
 import sys
 import tempfile
 import unittest
@@ -55,6 +56,35 @@ CACHED_GRANULES_BAD = {
     }
 }
 
+class FakeResponse(object):
+    def __init__(self, headers, content):
+        self.status_code = 200
+        self.headers = headers
+        self.text = json.dumps(content)
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeHTTP(object):
+    def __init__(self, *pages, **kwargs):
+        self.pages = list(pages)
+        self.requests = []
+        self.hits_header = kwargs.get("hits_header", "CMR-Hits")
+        self.scroll_id_header = kwargs.get("scroll_id_header", "CMR-Scroll-Id")
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, dict(params), dict(headers)))
+        content = self.pages.pop(0)
+        return FakeResponse(CaseInsensitiveHeaders({ self.hits_header: "2", self.scroll_id_header: "12345" }), content)
+
+class CaseInsensitiveHeaders(dict):
+    # Mimics the header lookup of a requests response, while keeping the original header names
+    def __getitem__(self, name):
+        for key, value in self.items():
+            if key.lower() == name.lower():
+                return value
+        raise KeyError(name)
+
 class TestException(Exception):
     pass
 
@@ -298,10 +328,253 @@ class TestMain(unittest.TestCase):
             self.assertIn("-o {}.{}".format(dataset_name, concept_format.file_ext), curl_cmd)
             self.assertIn("Accept: {}".format(concept_format.accept_header), curl_cmd)
 
+    def test_record_replay(self):
+        archive = os.path.join(self.tmp_dir, "archive.json.gz")
+        self.PARAMS['temp_dir'] = os.path.join(self.tmp_dir, "record")
+        filename = os.path.join(self.bin_dir, "ABoVE_AirSWOT_Radar_Data", "metadata", "metadata.curl")
+
+        # Record a run with an empty cache
+        recorder = umcf.Recorder(FakeHTTP(CACHED_COLLECTIONS_1, CACHED_GRANULES_1))
+        umcf.main(http=recorder, **self.PARAMS)
+        recorder.save(archive)
+        recorded_events = self.events._events
+        with open(filename, "r") as file:
+            recorded_curl = file.read()
+        os.remove(filename)
+
+        # Replay the run with another empty cache
+        self.events.clearEvents()
+        self.PARAMS['temp_dir'] = os.path.join(self.tmp_dir, "replay")
+        replayer = umcf.Replayer(archive)
+        umcf.main(http=replayer, **self.PARAMS)
+        replayer.finish()
+        with open(filename, "r") as file:
+            replayed_curl = file.read()
+
+        self.assertEqual(len(recorder.exchanges), 2)
+        self.assertEqual(self.events._events, recorded_events)
+        self.assertEqual(replayed_curl, recorded_curl)
+
+    def test_replay_cached(self):
+        archive = os.path.join(self.tmp_dir, "archive.json.gz")
+        self.PARAMS['temp_dir'] = os.path.join(self.tmp_dir, "record")
+        recorder = umcf.Recorder(FakeHTTP(CACHED_COLLECTIONS_1, CACHED_GRANULES_1))
+        umcf.main(http=recorder, **self.PARAMS)
+        recorder.save(archive)
+
+        # Replaying with the cache of the recorded run ignores the cache and leaves it untouched
+        with open(os.path.join(self.PARAMS['temp_dir'], "granules_C1604360562-ORNL_DAAC.json"), 'w') as file:
+            json.dump(CACHED_GRANULES_BAD, file)
+        cached_files = sorted(os.listdir(self.PARAMS['temp_dir']))
+        self.events.clearEvents()
+        replayer = umcf.Replayer(archive)
+        umcf.main(http=replayer, **self.PARAMS)
+        replayer.finish()
+        self.events.assertEvents(
+            TestEvents.collections_download_starting,
+            TestEvents.collections_download_succeeded,
+            TestEvents.granules_download_starting,
+            TestEvents.granules_download_succeeded,
+            TestEvents.writing_curl_file_starting,
+            TestEvents.writing_curl_file_succeeded,
+        )
+        self.assertEqual(sorted(os.listdir(self.PARAMS['temp_dir'])), cached_files)
+        with open(os.path.join(self.PARAMS['temp_dir'], "granules_C1604360562-ORNL_DAAC.json"), 'r') as file:
+            self.assertEqual(json.load(file), CACHED_GRANULES_BAD)
+
+    def test_replay_granules_mismatch(self):
+        archive = os.path.join(self.tmp_dir, "archive.json.gz")
+        self.PARAMS['temp_dir'] = os.path.join(self.tmp_dir, "record")
+        recorder = umcf.Recorder(FakeHTTP(CACHED_COLLECTIONS_2, CACHED_GRANULES_1, CACHED_GRANULES_1))
+        umcf.main(http=recorder, **self.PARAMS)
+        recorder.exchanges[1]["params"]["concept_id"] = "C0000000000-ORNL_DAAC"
+        recorder.save(archive)
+
+        # A mismatching granule request stops the run instead of continuing with the next collection
+        self.events.clearEvents()
+        with self.assertRaises(umcf.ReplayMismatchError):
+            umcf.main(http=umcf.Replayer(archive), **self.PARAMS)
+        self.events.assertEvents(
+            TestEvents.collections_download_starting,
+            TestEvents.collections_download_succeeded,
+            TestEvents.granules_download_starting,
+            TestEvents.granules_download_failed,
+        )
+
     def test_invalid_concept_format(self):
         self.PARAMS['concept_format'] = "INVALID_FORMAT"
         with self.assertRaises(ValueError):
             umcf.main(**self.PARAMS)
 
+    def test_offline_cached(self):
+        self.PARAMS['offline'] = True
+        self.test_granules_cached()
+
+    def test_offline_no_network_stack(self):
+        # Create 1 cached collection
+        with open(os.path.join(self.tmp_dir, "collections_ABoVE_ORNL_DAAC.json"), 'w') as file:
+            json.dump(CACHED_COLLECTIONS_1, file)
+
+        # Create 1 cached granule
+        with open(os.path.join(self.tmp_dir, "granules_C1604360562-ORNL_DAAC.json"), 'w') as file:
+            json.dump(CACHED_GRANULES_1, file)
+
+        # Run offline in a fresh interpreter, since other tests may have imported requests already
+        script = (
+            "import sys\n"
+            "import update_metadata_curl_files as umcf\n"
+            "umcf.main('ORNL_DAAC', 'ABoVE', False, False, temp_dir=sys.argv[1], output_dir=sys.argv[2], offline=True)\n"
+            "sys.exit('requests' in sys.modules)\n"
+        )
+        returncode = subprocess.call(
+            [sys.executable, "-c", script, self.tmp_dir, self.bin_dir],
+            cwd=os.path.dirname(os.path.abspath(umcf.__file__))
+        )
+        self.assertEqual(returncode, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.bin_dir, "ABoVE_AirSWOT_Radar_Data", "metadata", "metadata.curl")))
+
+    def test_offline_collections_uncached(self):
+        self.PARAMS['offline'] = True
+        with self.assertRaises(EnvironmentError):
+            umcf.main(**self.PARAMS)
+        self.events.assertEvents(
+            TestEvents.collections_download_cached,
+            TestEvents.collections_download_failed,
+        )
+
+    def test_offline_granules_uncached(self):
+        # Create 1 cached collection
+        with open(os.path.join(self.tmp_dir, "collections_ABoVE_ORNL_DAAC.json"), 'w') as file:
+            json.dump(CACHED_COLLECTIONS_1, file)
+
+        self.PARAMS['offline'] = True
+        with self.assertRaises(EnvironmentError):
+            umcf.main(**self.PARAMS)
+        self.events.assertEvents(
+            TestEvents.collections_download_cached,
+            TestEvents.collections_download_succeeded,
+            TestEvents.granules_download_cached,
+            TestEvents.granules_download_failed,
+        )
+
+    def test_offline_inexistant_temp_dir(self):
+        tmp_dir = os.path.join(self.tmp_dir, "tmp_dir")
+        bin_dir = os.path.join(self.bin_dir, "bin_dir")
+        self.PARAMS['temp_dir'] = tmp_dir
+        self.PARAMS['output_dir'] = bin_dir
+        self.PARAMS['offline'] = True
+
+        with self.assertRaises(ValueError):
+            umcf.main(**self.PARAMS)
+        self.events.assertEvents()
+
+        self.assertFalse(os.path.exists(tmp_dir))
+        self.assertFalse(os.path.exists(bin_dir))
+
+    def test_offline_http(self):
+        self.PARAMS['offline'] = True
+        with self.assertRaises(ValueError):
+            umcf.main(http=umcf.Recorder(FakeHTTP()), **self.PARAMS)
+
+    def test_offline_update(self):
+        self.PARAMS['offline'] = True
+        self.PARAMS['update_granules'] = True
+        with self.assertRaises(ValueError):
+            umcf.main(**self.PARAMS)
+
+class TestRecordReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmp_dir, "archive.json.gz")
+        self.old_query_page_size = umcf.QUERY_PAGE_SIZE
+        umcf.QUERY_PAGE_SIZE = 1
+        return super(TestRecordReplay, self).setUp()
+
+    def tearDown(self):
+        umcf.QUERY_PAGE_SIZE = self.old_query_page_size
+        shutil.rmtree(self.tmp_dir)
+        return super(TestRecordReplay, self).tearDown()
+
+    def record(self):
+        http = FakeHTTP(
+            { "feed": { "entry": [ { "id": "G1" } ] } },
+            { "feed": { "entry": [ { "id": "G2" } ] } },
+        )
+        recorder = umcf.Recorder(http)
+        recorded = umcf.download_from_cmr("granules", self.tmp_dir, recorder, concept_id="C1")
+        recorder.save(self.archive)
+        return http, recorded
+
+    def test_record(self):
+        http, recorded = self.record()
+        self.assertEqual(len(http.requests), 2)
+        self.assertEqual(len(recorded['feed']['entry']), 2)
+        self.assertTrue(os.path.exists(self.archive))
+
+        # Scroll ID of the first response must be sent with the second request
+        self.assertEqual(http.requests[1][2]["CMR-Scroll-Id"], "12345")
+
+    def test_replay(self):
+        _, recorded = self.record()
+        for realtime in (False, True):
+            replayer = umcf.Replayer(self.archive, realtime)
+            replayed = umcf.download_from_cmr("granules", self.tmp_dir, replayer, concept_id="C1")
+            self.assertEqual(replayed, recorded)
+            self.assertEqual(replayer.position, len(replayer.exchanges))
+
+    def test_replay_timing(self):
+        http = FakeHTTP(
+            { "feed": { "entry": [ { "id": "G1" } ] } },
+            { "feed": { "entry": [ { "id": "G2" } ] } },
+        )
+        recorder = umcf.Recorder(http)
+        umcf.download_from_cmr("granules", self.tmp_dir, recorder, concept_id="C1")
+        recorder.exchanges[0]["response"]["elapsed"] = 0.5
+        recorder.exchanges[1]["response"]["elapsed"] = 1.5
+        recorder.save(self.archive)
+
+        sleeps = []
+        old_sleep = umcf.time.sleep
+        umcf.time.sleep = sleeps.append
+        try:
+            for realtime, expected_sleeps in ((False, []), (True, [0.5, 1.5])):
+                del sleeps[:]
+                replayer = umcf.Replayer(self.archive, realtime)
+                response = replayer.get(recorder.exchanges[0]["url"], recorder.exchanges[0]["params"])
+                replayer.get(recorder.exchanges[1]["url"], recorder.exchanges[1]["params"])
+                self.assertEqual(sleeps, expected_sleeps)
+                self.assertEqual(response.elapsed.total_seconds(), 0.5)
+        finally:
+            umcf.time.sleep = old_sleep
+
+    def test_replay_lowercase_headers(self):
+        http = FakeHTTP(
+            { "feed": { "entry": [ { "id": "G1" } ] } },
+            { "feed": { "entry": [ { "id": "G2" } ] } },
+            hits_header="cmr-hits",
+            scroll_id_header="cmr-scroll-id",
+        )
+        recorder = umcf.Recorder(http)
+        recorded = umcf.download_from_cmr("granules", self.tmp_dir, recorder, concept_id="C1")
+        recorder.save(self.archive)
+
+        replayer = umcf.Replayer(self.archive)
+        replayed = umcf.download_from_cmr("granules", self.tmp_dir, replayer, concept_id="C1")
+        self.assertEqual(replayed, recorded)
+        replayer.finish()
+
+    def test_replay_mismatch(self):
+        self.record()
+        replayer = umcf.Replayer(self.archive)
+        with self.assertRaises(ValueError):
+            umcf.download_from_cmr("granules", self.tmp_dir, replayer, concept_id="C2")
+
+    def test_replay_exhausted(self):
+        self.record()
+        replayer = umcf.Replayer(self.archive)
+        umcf.download_from_cmr("granules", self.tmp_dir, replayer, concept_id="C1")
+        with self.assertRaises(ValueError):
+            umcf.download_from_cmr("granules", self.tmp_dir, replayer, concept_id="C1")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
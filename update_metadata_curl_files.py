@@ -10,15 +10,21 @@ This script does the following:
 The raw output of each CMR query in steps 1 & 2 is stored in the temporary directory.
 This behaviour can be disabled with command line flags to check for changes on the CMR.
 
+All HTTP requests to the CMR can be recorded to a compressed archive and replayed later
+without network access, either at full speed or with the original response timings.
+In offline mode, curl files are created from cached query results only and the network stack isn't loaded.
+
 Written 10/2018 by S. Klaassen
 """
 
 from __future__ import print_function
 from argparse import ArgumentParser, RawTextHelpFormatter
+import datetime
+import gzip
 import json
 import math
 import os.path
-import requests
+import time
 
 class QueryResultFormat(object):
     def __init__(self, accept_header, file_ext):
@@ -79,48 +85,172 @@ def retrieve_cached(what, temp_dir, **params):
     with open(filename, "r") as f:
         return json.loads(f.read())
 
-def download_from_cmr(what, temp_dir, **params):
+def download_from_cmr(what, temp_dir, http=None, **params):
     """Issue a search query to CMR and return a dict of the JSON response
 
     For documentation on what can be searched for on the CMR, refer to
     https://cmr.earthdata.nasa.gov/search/site/docs/search/api.html#collection-search-by-parameters
     (Parameters to this function correspond the chapter: "Find `what` by `params`").
 
-    Results are stored in a JSON file in the `temp_dir` directory.
+    Results are stored in a JSON file in the `temp_dir` directory, unless `temp_dir` is None.
     Subsequent searches will return stored results, if available.
     
     Args:
         what (String): The type of data to find
-        temp_dir (String): The directory containing cached query results
+        temp_dir (String): The directory containing cached query results or None
+        http (object, optional): The HTTP client used to query CMR (e.g. a `Recorder` or `Replayer`). Defaults to `requests`.
         params (String): Search criteria and parameter options
     
     Returns:
         dict: JSON response content
     """
 
-    filename = os.path.join(temp_dir, '_'.join([what] + list(params.values())) + ".json")
+    if http is None:
+        import requests # Imported lazily to keep startup fast for cache-only runs
+        http = requests
+
+    if temp_dir is not None:
+        filename = os.path.join(temp_dir, '_'.join([what] + list(params.values())) + ".json")
 
     # Query first page of search results
     headers = { "Accept": "application/json" }
     params["page_size"] = QUERY_PAGE_SIZE
     params["scroll"] = 'true'
-    response = requests.get("https://cmr.earthdata.nasa.gov/search/" + what, params=params, headers=headers)
+    response = http.get("https://cmr.earthdata.nasa.gov/search/" + what, params=params, headers=headers)
     num_entries = int(response.headers['CMR-Hits'])
     headers["CMR-Scroll-Id"] = response.headers['CMR-Scroll-Id']
     json_response = response.json()
 
     # Query remaining pages
     for _ in range(int(math.ceil(num_entries / QUERY_PAGE_SIZE) - 1)):
-        response = requests.get("https://cmr.earthdata.nasa.gov/search/" + what, params=params, headers=headers)
+        response = http.get("https://cmr.earthdata.nasa.gov/search/" + what, params=params, headers=headers)
         json_response_page = response.json()
         json_response['feed']['entry'] += json_response_page['feed']['entry'] # Append entries of this page to json_response
 
     # Save results to JSON file
-    with open(filename, "w") as f:
-        f.write(json.dumps(json_response, indent=4))
+    if temp_dir is not None:
+        with open(filename, "w") as f:
+            f.write(json.dumps(json_response, indent=4))
 
     return json_response
 
+class RecordedHeaders(dict):
+    """Response headers with case-insensitive names, like the headers of a `requests` response."""
+
+    def __init__(self, headers):
+        super(RecordedHeaders, self).__init__((name.lower(), value) for name, value in headers.items())
+
+    def __getitem__(self, name):
+        return super(RecordedHeaders, self).__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super(RecordedHeaders, self).__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super(RecordedHeaders, self).get(name.lower(), default)
+
+class RecordedResponse(object):
+    def __init__(self, status_code, headers, text, elapsed):
+        self.status_code = status_code
+        self.headers = RecordedHeaders(headers)
+        self.text = text
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+
+    def json(self):
+        return json.loads(self.text)
+
+class Recorder(object):
+    """Record all HTTP requests and responses issued through `get`.
+
+    Recorded exchanges are saved to a gzip compressed JSON archive, which can be replayed with `Replayer`.
+
+    Args:
+        http (object, optional): The HTTP client to record. Defaults to `requests`.
+    """
+
+    def __init__(self, http=None):
+        if http is None:
+            import requests
+            http = requests
+        self.http = http
+        self.exchanges = []
+
+    def get(self, url, params=None, headers=None):
+        start = time.time()
+        response = self.http.get(url, params=params, headers=headers)
+        text = response.text # Make sure the whole response body is included in the elapsed time
+        elapsed = time.time() - start
+
+        self.exchanges.append({
+            "url": url,
+            "params": _normalize_params(params),
+            "headers": dict(headers or {}),
+            "response": {
+                "status_code": response.status_code,
+                "headers": dict(response.headers),
+                "text": text,
+                "elapsed": elapsed,
+            },
+        })
+        return response
+
+    def save(self, filename):
+        """Save all recorded exchanges to the gzip compressed JSON archive `filename`."""
+
+        with gzip.open(filename, "wb") as f:
+            f.write(json.dumps(self.exchanges, separators=(',', ':')).encode("utf-8"))
+
+class ReplayMismatchError(ValueError):
+    """Raised if replayed requests don't match the recording."""
+    pass
+
+class Replayer(object):
+    """Replay HTTP responses from an archive created by `Recorder`.
+
+    Requests must be issued in the same order as they were recorded.
+    A `ReplayMismatchError` is raised if a request doesn't match the recording.
+    Call `finish` after the last request to make sure the whole recording was replayed.
+
+    Args:
+        filename (String): The archive to replay
+        realtime (boolean, optional): If true, delay each response by its originally recorded duration. Defaults to False.
+    """
+
+    def __init__(self, filename, realtime=False):
+        with gzip.open(filename, "rb") as f:
+            self.exchanges = json.loads(f.read().decode("utf-8"))
+        self.realtime = realtime
+        self.position = 0
+
+    def get(self, url, params=None, headers=None):
+        if self.position >= len(self.exchanges):
+            raise ReplayMismatchError("No recorded response left for request: {} {}".format(url, params))
+
+        exchange = self.exchanges[self.position]
+        if exchange["url"] != url or exchange["params"] != _normalize_params(params):
+            raise ReplayMismatchError(
+                "Request doesn't match recording: expected {} {}, got {} {}"
+                .format(exchange["url"], exchange["params"], url, _normalize_params(params))
+            )
+        self.position += 1
+
+        response = exchange["response"]
+        if self.realtime:
+            time.sleep(response["elapsed"])
+        return RecordedResponse(response["status_code"], response["headers"], response["text"], response["elapsed"])
+
+    def finish(self):
+        """Raise a `ReplayMismatchError` if any recorded requests haven't been replayed."""
+
+        if self.position != len(self.exchanges):
+            raise ReplayMismatchError(
+                "{} of {} recorded requests were not replayed"
+                .format(len(self.exchanges) - self.position, len(self.exchanges))
+            )
+
+def _normalize_params(params):
+    return dict((str(key), str(value)) for key, value in (params or {}).items())
+
 class Events(object):
     def collections_download_starting(self):
         pass 
@@ -181,15 +311,28 @@ class PrintEvents(Events):
     def writing_curl_file_failed(self, collection, dataset_name, granules, err):
         print("raised", repr(err))
 
-def main(data_center, project, update_collections, update_granules, events=Events(), temp_dir=TEMP_DIR, output_dir=OUTPUT_DIR, concept_format=DEFAULT_CONCEPT_FORMAT):
+def main(data_center, project, update_collections, update_granules, events=Events(), temp_dir=TEMP_DIR, output_dir=OUTPUT_DIR, concept_format=DEFAULT_CONCEPT_FORMAT, http=None, offline=False):
     # Validate arguments
     try:
         concept_format = SUPPORTED_CONCEPT_FORMATS[concept_format]
     except KeyError:
         raise ValueError("Unsupported response format for CMR concept queries: {}".format(concept_format))
+    if offline and (update_collections or update_granules):
+        raise ValueError("Cached query results can't be updated in offline mode")
+    if offline and http is not None:
+        raise ValueError("An HTTP client can't be used in offline mode")
+    if offline and not os.path.isdir(temp_dir):
+        raise ValueError("Directory for cached CMR queries doesn't exist: {}".format(temp_dir))
+
+    # Recorded and replayed runs must issue every request, so they bypass the cache.
+    # Replayed runs don't store their results in temp_dir either.
+    if isinstance(http, (Recorder, Replayer)):
+        update_collections = update_granules = True
+    if isinstance(http, Replayer):
+        temp_dir = None
     
     # Make sure temp_dir and output_dir exist
-    if not os.path.exists(temp_dir):
+    if temp_dir is not None and not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -201,17 +344,20 @@ def main(data_center, project, update_collections, update_granules, events=Event
 
     # Download all that match queryparams from CMR
     try:
-        if not update_collections and is_cached("collections", temp_dir, **queryparams):
+        if offline: # If only cached collections may be used, fail on cache misses
+            events.collections_download_cached()
+            collections = retrieve_cached("collections", temp_dir, **queryparams)['feed']['entry']
+        elif not update_collections and is_cached("collections", temp_dir, **queryparams):
             try:
                 events.collections_download_cached()
                 collections = retrieve_cached("collections", temp_dir, **queryparams)['feed']['entry']
             except Exception as err: # If retrieving the cached collections failed, ...
                 events.collections_download_cached_failed(err)
                 events.collections_download_starting()
-                collections = download_from_cmr("collections", temp_dir, **queryparams)['feed']['entry']
+                collections = download_from_cmr("collections", temp_dir, http, **queryparams)['feed']['entry']
         else: # If using cached collections is disabled, ...
             events.collections_download_starting()
-            collections = download_from_cmr("collections", temp_dir, **queryparams)['feed']['entry']
+            collections = download_from_cmr("collections", temp_dir, http, **queryparams)['feed']['entry']
     except Exception as err:
         events.collections_download_failed(err)
         raise
@@ -227,19 +373,24 @@ def main(data_center, project, update_collections, update_granules, events=Event
 
         # Download all granules associated with this concept ID from CMR
         try:
-            if not update_granules and is_cached("granules", temp_dir, concept_id=concept_id):
+            if offline: # If only cached granules may be used, fail on cache misses
+                events.granules_download_cached(collection, dataset_name)
+                granules = retrieve_cached("granules", temp_dir, concept_id=concept_id)['feed']['entry']
+            elif not update_granules and is_cached("granules", temp_dir, concept_id=concept_id):
                 try:
                     events.granules_download_cached(collection, dataset_name)
                     granules = retrieve_cached("granules", temp_dir, concept_id=concept_id)['feed']['entry']
                 except Exception as err: # If retrieving the cached granules failed, ...
                     events.granules_download_cached_failed(collection, dataset_name, err)
                     events.granules_download_starting(collection, dataset_name)
-                    granules = download_from_cmr("granules", temp_dir, concept_id=concept_id)['feed']['entry']
+                    granules = download_from_cmr("granules", temp_dir, http, concept_id=concept_id)['feed']['entry']
             else: # If using cached granules is disabled, ...
                 events.granules_download_starting(collection, dataset_name)
-                granules = download_from_cmr("granules", temp_dir, concept_id=concept_id)['feed']['entry']
+                granules = download_from_cmr("granules", temp_dir, http, concept_id=concept_id)['feed']['entry']
         except Exception as err:
             events.granules_download_failed(collection, dataset_name, err)
+            if offline or isinstance(err, ReplayMismatchError):
+                raise
             continue
         else:
             events.granules_download_succeeded(collection, dataset_name, granules)
@@ -294,12 +445,40 @@ if __name__ == "__main__": # pragma: no cover
         default=DEFAULT_CONCEPT_FORMAT,
         help="response format for granule downloads"
     )
+    argparser.add_argument("--offline", dest="offline", help="only use cached query results and fail on cache misses", action="store_true")
+    argparser.add_argument("--record", dest="record", metavar="ARCHIVE", help="record all CMR requests and responses to ARCHIVE")
+    argparser.add_argument("--replay", dest="replay", metavar="ARCHIVE", help="replay CMR responses from ARCHIVE instead of querying CMR")
+    argparser.add_argument("--replay-timing", dest="replay_timing", help="delay replayed responses by their recorded duration", action="store_true")
     args = argparser.parse_args()
+    if args.replay and args.record:
+        argparser.error("--record and --replay are mutually exclusive")
+    if args.replay_timing and not args.replay:
+        argparser.error("--replay-timing requires --replay")
+    if args.offline and (args.replay or args.record):
+        argparser.error("--offline can't be combined with --record or --replay")
+    if args.replay and os.path.abspath(args.output_dir) == os.path.abspath(OUTPUT_DIR):
+        argparser.error("--replay requires an --output-dir other than the default")
+
+    # Offline runs are quiet to keep wrapper scripts fast; errors are still raised
+    events = Events()
+    if not args.offline:
+        events = PrintEvents()
+        print("")
+        print("Creating metadata curl scripts with the following parameters:")
+        for parameter, value in args.__dict__.items():
+            print("  {}={}".format(parameter, value))
+        print("")
+
+    http = None
+    if args.replay:
+        http = Replayer(args.replay, args.replay_timing)
+    elif args.record:
+        http = Recorder()
 
-    print("")
-    print("Creating metadata curl scripts with the following parameters:")
-    for parameter, value in args.__dict__.items():
-        print("  {}={}".format(parameter, value))
-    print("")
-
-    main(args.data_center, args.project, args.update_collections, args.update_granules, PrintEvents(), args.temp_dir, args.output_dir, args.concept_format)
+    try:
+        main(args.data_center, args.project, args.update_collections, args.update_granules, events, args.temp_dir, args.output_dir, args.concept_format, http, args.offline)
+    finally:
+        if args.record:
+            http.save(args.record)
+    if args.replay:
+        http.finish()